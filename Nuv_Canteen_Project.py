@@ -7,34 +7,64 @@ Features:
  - QR generation (qrcode + pillow) if available; otherwise simulation
  - UPI ID input next to QR
  - Admin panel (menu management + simple order analytics)
+ - Salted PBKDF2 password hashes, checked off the UI thread, with a session cache
+ - Reads routed to MySQL read replicas (lag-aware), writes to the primary
+ - Old orders archived into monthly tables in the background (history/analytics still see them)
+ - UPI statement reconciliation (order reference + UPI ID stored per Online order)
  - Dark / Light mode toggle
+ - Daily stock per item (sharded counters), reserved at order time, sold-out items marked
+ - Receipts (text / ESC-POS) produced by a background print spooler with retry
+ - Money kept as integer paise in the cart, the DB and all totals
+ - Fast start: heavy libraries imported on first use, panels filled after the first frame,
+   optional startup profile (NUV_PROFILE_STARTUP=1 or --profile-startup)
 """
 
+import time
+_STARTUP_T0 = time.perf_counter()
+
 import tkinter as tk
 from tkinter import ttk, messagebox, Toplevel, simpledialog, filedialog
-from datetime import datetime
+from datetime import datetime, date, timedelta
+from contextlib import contextmanager
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+import importlib
+import importlib.util
 import os
 import sys
 import math
-
-# DB connector
-try:
-    import mysql.connector
-    MYSQL_AVAILABLE = True
-except Exception:
-    MYSQL_AVAILABLE = False
-
-# QR + Image libraries
-try:
-    import qrcode
-    from PIL import Image, ImageTk, ImageFilter
-    QR_LIBS_AVAILABLE = True
-except Exception:
-    QR_LIBS_AVAILABLE = False
+import csv
+import re
+import secrets
+import threading
+import queue
+import socket
+import itertools
+import random
+from collections import Counter
+import hashlib
+import hmac
+import base64
+import binascii
+
+
+def _module_available(name):
+    # find_spec only locates the module; nothing heavy is imported here
+    try:
+        return importlib.util.find_spec(name) is not None
+    except Exception:
+        return False
+
+
+# DB connector (imported on first connection)
+MYSQL_AVAILABLE = _module_available("mysql.connector")
+
+# QR + Image libraries (imported on first QR / background image)
+QR_LIBS_AVAILABLE = _module_available("qrcode") and _module_available("PIL")
 
 # -------------------------
 # CONFIG
 # -------------------------
+# primary: all writes (orders, signup, menu edits) go here
 DB_CONFIG = {
     "host": "localhost",
     "user": "root",
@@ -42,18 +72,1086 @@ DB_CONFIG = {
     "database": "navrachana_canteen"
 }
 
+# fast start: show the window first, then fill menu / backgrounds step by step
+FAST_START = os.environ.get("NUV_FAST_START", "1") != "0"
+PROFILE_STARTUP = os.environ.get("NUV_PROFILE_STARTUP") == "1" or "--profile-startup" in sys.argv
+STARTUP_PROFILE_LOG = "startup_profile.log"
+
+# optional read replicas for menu / history / analytics; empty -> everything uses DB_CONFIG
+REPLICA_CONFIGS = [
+    # {**DB_CONFIG, "host": "127.0.0.1", "port": 3307},
+]
+MAX_REPLICA_LAG = 5              # seconds; replicas further behind are skipped
+REPLICA_CHECK_INTERVAL = 10      # seconds between lag checks per replica
+READ_YOUR_WRITES_WINDOW = 30     # seconds a writer's own reads stay on the primary
+
+THALI_PRICES = {"Half": 4000, "Full": 7000}    # paise
+
+# daily stock: each item's count is split over STOCK_SHARDS rows so terminals
+# decrementing at the same time rarely wait on the same row lock
+STOCK_SHARDS = 4
+HIDE_SOLD_OUT = False            # False: keep sold-out rows visible but greyed out
+STOCK_REFRESH_MS = 30000
+
+# receipts: always saved as text under RECEIPT_DIR; also sent as ESC/POS to RECEIPT_PRINTER
+# if set - a device path ("/dev/usb/lp0", "LPT1") or a network printer ("192.168.1.50", 9100)
+RECEIPT_PRINTER = None
+RECEIPT_DIR = "receipts"
+RECEIPT_WIDTH = 32               # characters per line (58 mm paper)
+RECEIPT_RETRIES = 3
+RECEIPT_RETRY_DELAY = 2          # seconds, doubled after each failed attempt
+BILL_AUTO_CLOSE_MS = 20000       # on-screen bill closes itself so the counter keeps moving
+
 APP_WIDTH = 1250
 APP_HEIGHT = 690
 LEFT_W, LEFT_H = 520, 570
 RIGHT_W, RIGHT_H = 510, 570
 
+# -------------------------
+# STARTUP PROFILER + LAZY IMPORTS
+# -------------------------
+class StartupProfiler:
+    """Records (phase, offset from process start, duration) for the startup report."""
+
+    def __init__(self, t0):
+        self.t0 = t0
+        self.phases = []
+        self._lock = threading.Lock()
+
+    def record(self, name, start, end):
+        with self._lock:
+            self.phases.append((name, start - self.t0, end - start))
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter())
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.record(name, now, now)
+
+    def report(self):
+        lines = [f"{'phase':<28}{'at ms':>10}{'took ms':>10}"]
+        for name, at, took in sorted(self.phases, key=lambda p: p[1]):
+            lines.append(f"{name:<28}{at * 1000:>10.1f}{took * 1000:>10.1f}")
+        return "\n".join(lines)
+
+
+PROFILER = StartupProfiler(_STARTUP_T0)
+
+
+def lazy_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+    with PROFILER.phase(f"import {name}"):
+        return importlib.import_module(name)
+
+
+# -------------------------
+# MONEY (integer paise)
+# -------------------------
+def to_paise(value):
+    """Rupee amount (str / int / float / Decimal, e.g. "₹1,250.50") -> int paise, exactly."""
+    text = str(value).replace(",", "").replace("₹", "").strip()
+    try:
+        amount = Decimal(text or "0") * 100
+    except InvalidOperation:
+        raise ValueError(f"Not a money amount: {value!r}")
+    if not amount.is_finite():
+        raise ValueError(f"Not a money amount: {value!r}")
+    return int(amount.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def rupees(paise):
+    """int paise -> '1250.50' for display (no float rounding)."""
+    sign = "-" if paise < 0 else ""
+    whole, frac = divmod(abs(int(paise)), 100)
+    return f"{sign}{whole}.{frac:02d}"
+
+
 # -------------------------
 # DB HELPER
 # -------------------------
-def get_db():
+_replica_state = {}            # replica index -> (checked_at, lag seconds or None if unusable)
+_last_write = {}               # key (student_id, "menu", ...) -> time of last write
+_replica_rr = itertools.count()
+
+
+def note_write(key):
+    # remember recent writers so their next reads see their own data
+    _last_write[key] = time.time()
+
+
+def _replica_lag(conn):
+    cur = conn.cursor(dictionary=True)
+    try:
+        try:
+            cur.execute("SHOW REPLICA STATUS")
+        except Exception:
+            cur.execute("SHOW SLAVE STATUS")    # MySQL < 8.0.22
+        row = cur.fetchone()
+    finally:
+        cur.close()
+    if not row:
+        return None                          # not replicating -> data may be arbitrarily stale
+    lag = row.get("Seconds_Behind_Source", row.get("Seconds_Behind_Master"))
+    return None if lag is None else int(lag)
+
+
+def _connect_replica():
+    n = len(REPLICA_CONFIGS)
+    start = next(_replica_rr) % n
+    for i in [(start + k) % n for k in range(n)]:
+        checked_at, lag = _replica_state.get(i, (0.0, None))
+        fresh = time.time() - checked_at < REPLICA_CHECK_INTERVAL
+        if fresh and (lag is None or lag > MAX_REPLICA_LAG):
+            continue
+        try:
+            conn = lazy_import("mysql.connector").connect(**{"connection_timeout": 2, **REPLICA_CONFIGS[i]})
+        except Exception:
+            _replica_state[i] = (time.time(), None)
+            continue
+        if not fresh:
+            try:
+                lag = _replica_lag(conn)
+            except Exception:
+                lag = None
+            _replica_state[i] = (time.time(), lag)
+            if lag is None or lag > MAX_REPLICA_LAG:
+                conn.close()
+                continue
+        return conn
+    return None
+
+
+def get_db(read=False, key=None):
+    """
+    Connection to the primary, or to a healthy replica when read=True.
+    key identifies whose data is read (student_id, "menu"); if that key was written
+    within READ_YOUR_WRITES_WINDOW the read stays on the primary.
+    """
     if not MYSQL_AVAILABLE:
         raise RuntimeError("MySQL connector not installed. Install `mysql-connector-python` or set MYSQL_AVAILABLE False.")
-    return mysql.connector.connect(**DB_CONFIG)
+    if read and REPLICA_CONFIGS:
+        recent = key is not None and time.time() - _last_write.get(key, 0) < READ_YOUR_WRITES_WINDOW
+        if not recent:
+            conn = _connect_replica()
+            if conn is not None:
+                return conn
+    return lazy_import("mysql.connector").connect(**DB_CONFIG)
+
+# -------------------------
+# USER DIRECTORY (hashed passwords + session cache)
+# -------------------------
+PASSWORD_HASH_ITERATIONS = 200_000    # raise on faster hardware; old hashes upgrade at next login
+SESSION_TTL = 15 * 60                 # seconds a verified login is remembered on this terminal
+_HASH_PREFIX = "pbkdf2_sha256"
+
+
+def hash_password(password, iterations=None):
+    iterations = iterations or PASSWORD_HASH_ITERATIONS
+    salt = secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return "$".join((_HASH_PREFIX, str(iterations),
+                     base64.b64encode(salt).decode(), base64.b64encode(digest).decode()))
+
+
+def verify_password(password, stored):
+    """Returns (ok, needs_rehash). Plaintext rows from before hashing are accepted once."""
+    stored = stored or ""
+    parts = stored.split("$")
+    if len(parts) != 4 or parts[0] != _HASH_PREFIX:
+        ok = hmac.compare_digest(password.encode(), stored.encode())
+        return ok, ok
+    try:
+        iterations = int(parts[1])
+        salt = base64.b64decode(parts[2], validate=True)
+        expected = base64.b64decode(parts[3], validate=True)
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    except (ValueError, binascii.Error):
+        # corrupt hash in the row: treat as a wrong password, not a DB error
+        return False, False
+    ok = hmac.compare_digest(digest, expected)
+    return ok, ok and iterations < PASSWORD_HASH_ITERATIONS
+
+
+class UserDirectory:
+    """
+    Student accounts keyed by the unique student_id.
+    Verified logins are cached in memory for SESSION_TTL, keyed by an HMAC of the
+    password under a per-process secret, so a returning student skips both the DB
+    round trip and the slow KDF. Methods may be called from worker threads.
+    """
+
+    def __init__(self, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self._sessions = {}      # student_id -> (expires_at, password tag, user dict)
+        self._lock = threading.Lock()
+        self._secret = secrets.token_bytes(32)
+
+    def _tag(self, password):
+        return hmac.new(self._secret, password.encode(), hashlib.sha256).digest()
+
+    def _cached(self, student_id, password):
+        with self._lock:
+            entry = self._sessions.get(student_id)
+            if not entry:
+                return None
+            expires_at, tag, user = entry
+            if expires_at < time.time():
+                del self._sessions[student_id]
+                return None
+            if not hmac.compare_digest(tag, self._tag(password)):
+                # maybe changed elsewhere: let the DB decide (authenticate forgets on failure)
+                return None
+            self._sessions[student_id] = (time.time() + self.ttl, tag, user)
+            return dict(user)
+
+    def _remember(self, student_id, password, user):
+        now = time.time()
+        with self._lock:
+            for k in [k for k, e in self._sessions.items() if e[0] < now]:
+                del self._sessions[k]
+            self._sessions[student_id] = (now + self.ttl, self._tag(password), dict(user))
+
+    def forget(self, student_id):
+        with self._lock:
+            self._sessions.pop(student_id, None)
+
+    def authenticate(self, student_id, password):
+        """User dict (without the password column) or None."""
+        user = self._cached(student_id, password)
+        if user:
+            return user
+        db = get_db(read=True, key=student_id)
+        cur = db.cursor(dictionary=True)
+        cur.execute("SELECT * FROM users WHERE student_id=%s", (student_id,))
+        row = cur.fetchone()
+        cur.close()
+        db.close()
+        if not row:
+            self.forget(student_id)
+            return None
+        ok, rehash = verify_password(password, row.get("password"))
+        if not ok:
+            self.forget(student_id)
+            return None
+        if rehash:
+            db = get_db()
+            cur = db.cursor()
+            cur.execute("UPDATE users SET password=%s WHERE id=%s", (hash_password(password), row["id"]))
+            db.commit()
+            cur.close()
+            db.close()
+            note_write(student_id)
+        user = {k: v for k, v in row.items() if k != "password"}
+        self._remember(student_id, password, user)
+        return dict(user)
+
+    def register(self, name, student_id, phone, password):
+        """Create an account; raises ValueError if the student ID is taken."""
+        db = get_db()
+        cur = db.cursor()
+        try:
+            cur.execute("SELECT 1 FROM users WHERE student_id=%s", (student_id,))
+            if cur.fetchone():
+                raise ValueError("This Student ID is already registered.")
+            try:
+                cur.execute("INSERT INTO users(name, student_id, phone, password) VALUES(%s,%s,%s,%s)",
+                            (name, student_id, phone, hash_password(password)))
+            except lazy_import("mysql.connector").IntegrityError:
+                # lost a race with another terminal (unique index on student_id)
+                raise ValueError("This Student ID is already registered.")
+            db.commit()
+        finally:
+            cur.close()
+            db.close()
+        note_write(student_id)
+
+
+USERS = UserDirectory()
+
+# -------------------------
+# ORDER ARCHIVE (monthly tables)
+# -------------------------
+# `orders` keeps only the last few months; older rows move to orders_archive_YYYYMM
+# (same structure) and their totals are rolled into orders_archive_summary.
+ARCHIVE_KEEP_MONTHS = 6
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_BATCH_PAUSE = 0.05     # seconds between batches so live inserts get the table
+ARCHIVE_LOCK_NAME = "nuv_archive"   # MySQL named lock: one compactor across all terminals
+ARCHIVE_TABLE_RE = re.compile(r"^orders_archive_(\d{4})(\d{2})$")
+
+
+def archive_table_name(d):
+    return f"orders_archive_{d.year}{d.month:02d}"
+
+
+def archive_cutoff(today=None, keep_months=ARCHIVE_KEEP_MONTHS):
+    # first day of the oldest month still kept in the live table
+    today = today or date.today()
+    months = today.year * 12 + (today.month - 1) - (keep_months - 1)
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def list_archive_tables(cur):
+    cur.execute("SHOW TABLES LIKE 'orders\\_archive\\_%'")
+    names = [r[0] if not isinstance(r, dict) else list(r.values())[0] for r in cur.fetchall()]
+    return sorted(n for n in names if ARCHIVE_TABLE_RE.match(n))
+
+
+def order_tables_for(archives, start=None, end=None):
+    """Live table plus the archive tables whose month overlaps [start, end]."""
+    tables = ["orders"]
+    lo = (start.year, start.month) if start else None
+    hi = (end.year, end.month) if end else None
+    for name in archives:
+        m = ARCHIVE_TABLE_RE.match(name)
+        ym = (int(m.group(1)), int(m.group(2)))
+        if (lo is None or ym >= lo) and (hi is None or ym <= hi):
+            tables.append(name)
+    return tables
+
+
+def fetch_orders(columns, where="1=1", params=(), start=None, end=None,
+                 include_archive=True, order_by=None, dictionary=False, key=None):
+    """
+    SELECT from orders and, when the range reaches back that far, the monthly archives
+    (UNION ALL). Only archive months overlapping [start, end] are touched.
+    Runs on a read replica when one is configured (see get_db).
+    """
+    db = get_db(read=True, key=key)
+    cur = db.cursor()
+    try:
+        archives = list_archive_tables(cur) if include_archive else []
+        if start and include_archive and start >= archive_cutoff():
+            archives = []
+        clause = where
+        extra = ()
+        if start:
+            clause += " AND date_for >= %s"
+            extra += (start,)
+        if end:
+            clause += " AND date_for <= %s"
+            extra += (end,)
+        tables = order_tables_for(archives, start, end)
+        sql = " UNION ALL ".join(f"SELECT {columns} FROM {t} WHERE {clause}" for t in tables)
+        if order_by:
+            sql += f" ORDER BY {order_by}"
+        cur.close()
+        cur = db.cursor(dictionary=dictionary)
+        cur.execute(sql, (tuple(params) + extra) * len(tables))
+        return cur.fetchall()
+    finally:
+        cur.close()
+        db.close()
+
+
+def compact_orders(keep_months=ARCHIVE_KEEP_MONTHS, batch_size=ARCHIVE_BATCH_SIZE, stop_event=None):
+    """
+    Move orders older than the keep window into their monthly archive table.
+    Works in small primary-key batches, one short transaction each, so the live
+    table is never locked for long. Returns the number of rows moved, or None if
+    another terminal is already compacting (every kiosk tries at startup).
+    """
+    cutoff = archive_cutoff(keep_months=keep_months)
+    db = get_db()
+    cur = db.cursor()
+    moved = 0
+    cur.execute("SELECT GET_LOCK(%s, 0)", (ARCHIVE_LOCK_NAME,))
+    if cur.fetchone()[0] != 1:
+        cur.close()
+        db.close()
+        return None
+    try:
+        cur.execute("CREATE TABLE IF NOT EXISTS orders_archive_summary ("
+                    "month CHAR(6) PRIMARY KEY, orders INT NOT NULL, revenue_paise BIGINT NOT NULL)")
+        created = set(list_archive_tables(cur))
+        while not (stop_event and stop_event.is_set()):
+            cur.execute("SELECT id, date_for FROM orders WHERE date_for < %s ORDER BY id LIMIT %s",
+                        (cutoff, batch_size))
+            rows = cur.fetchall()
+            if not rows:
+                break
+            by_month = {}
+            for oid, d in rows:
+                by_month.setdefault(archive_table_name(d), []).append(oid)
+            for table, ids in by_month.items():
+                if table not in created:
+                    cur.execute(f"CREATE TABLE IF NOT EXISTS {table} LIKE orders")
+                    created.add(table)
+                marks = ",".join(["%s"] * len(ids))
+                cur.execute(f"INSERT INTO {table} SELECT * FROM orders WHERE id IN ({marks})", ids)
+                cur.execute(
+                    "INSERT INTO orders_archive_summary (month, orders, revenue_paise) "
+                    f"SELECT %s, COUNT(*), IFNULL(SUM(price_paise),0) FROM orders WHERE id IN ({marks}) "
+                    "ON DUPLICATE KEY UPDATE orders=orders+VALUES(orders), revenue_paise=revenue_paise+VALUES(revenue_paise)",
+                    [table[-6:]] + ids)
+                cur.execute(f"DELETE FROM orders WHERE id IN ({marks})", ids)
+            db.commit()
+            moved += len(rows)
+            time.sleep(ARCHIVE_BATCH_PAUSE)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cur.execute("SELECT RELEASE_LOCK(%s)", (ARCHIVE_LOCK_NAME,))
+        cur.fetchone()
+        cur.close()
+        db.close()
+    return moved
+
+
+def fetch_order_totals():
+    """(count, revenue in paise) over live orders plus the archived monthly totals."""
+    db = get_db(read=True)
+    cur = db.cursor()
+    try:
+        cur.execute("SELECT COUNT(*), IFNULL(SUM(price_paise),0) FROM orders")
+        count, revenue = cur.fetchone()
+        # SUM over BIGINT comes back as an exact DECIMAL
+        count, revenue = int(count), int(revenue)
+        try:
+            cur.execute("SELECT IFNULL(SUM(orders),0), IFNULL(SUM(revenue_paise),0) FROM orders_archive_summary")
+            a_count, a_revenue = cur.fetchone()
+            count += int(a_count)
+            revenue += int(a_revenue)
+        except Exception:
+            # nothing archived yet
+            pass
+        return count, revenue
+    finally:
+        cur.close()
+        db.close()
+
+def _has_column(cur, table, column):
+    cur.execute("SELECT 1 FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=%s AND COLUMN_NAME=%s", (table, column))
+    return cur.fetchone() is not None
+
+
+def migrate_money_schema(batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    One-off: replace FLOAT rupee columns with BIGINT paise columns in menu_items,
+    orders, every archive table and the archive summary. Backfills in id batches
+    (like compact_orders) and is safe to re-run. Returns the tables changed.
+    """
+    db = get_db()
+    cur = db.cursor()
+    changed = []
+    try:
+        # (table, old column, new column, place new column after, batch by id?)
+        plan = [("menu_items", "price", "price_paise", "name", True),
+                ("orders", "price", "price_paise", "item_desc", True)]
+        plan += [(t, "price", "price_paise", "item_desc", True) for t in list_archive_tables(cur)]
+        plan.append(("orders_archive_summary", "revenue", "revenue_paise", "orders", False))
+        for table, old, new, after, by_id in plan:
+            if not _has_column(cur, table, old) or _has_column(cur, table, new):
+                continue
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {new} BIGINT NOT NULL DEFAULT 0 AFTER {after}")
+            if by_id:
+                cur.execute(f"SELECT IFNULL(MIN(id),0), IFNULL(MAX(id),0) FROM {table}")
+                lo, hi = cur.fetchone()
+                for start in range(lo, hi + 1, batch_size):
+                    cur.execute(f"UPDATE {table} SET {new}=ROUND({old}*100) WHERE id BETWEEN %s AND %s",
+                                (start, start + batch_size - 1))
+                    db.commit()
+            else:
+                cur.execute(f"UPDATE {table} SET {new}=ROUND({old}*100)")
+                db.commit()
+            cur.execute(f"ALTER TABLE {table} DROP COLUMN {old}")
+            changed.append(table)
+    finally:
+        cur.close()
+        db.close()
+    return changed
+
+# -------------------------
+# UPI RECONCILIATION
+# -------------------------
+# Order reference printed in the QR payload and expected back in the bank
+# statement remarks, e.g. NUV251019134502A1F3
+ORDER_REF_RE = re.compile(r"NUV\d{12}[0-9A-F]{4}")
+RECON_WINDOW_MINUTES = 30
+
+# statement header aliases (lower-cased) for the common bank / UPI app exports
+STATEMENT_COLUMNS = {
+    "time": ("txn date", "transaction date", "date", "value date", "datetime", "timestamp", "time"),
+    "amount": ("amount", "credit", "credit amount", "deposit", "deposit amt.", "amount (inr)"),
+    "ref": ("remarks", "narration", "description", "reference", "ref no", "note", "transaction remarks"),
+    "upi": ("upi id", "vpa", "payer vpa", "from", "payer"),
+}
+STATEMENT_DATE_FORMATS = (
+    "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d",
+    "%d-%m-%Y %H:%M:%S", "%d-%m-%Y %H:%M", "%d-%m-%Y",
+    "%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y",
+    "%d %b %Y %H:%M", "%d %b %Y", "%d-%b-%Y",
+)
+
+
+def new_order_ref():
+    return "NUV" + datetime.now().strftime("%y%m%d%H%M%S") + secrets.token_hex(2).upper()
+
+
+def _parse_statement_time(text, formats=STATEMENT_DATE_FORMATS):
+    text = (text or "").strip()
+    for fmt in formats:
+        try:
+            return datetime.strptime(text, fmt), fmt
+        except ValueError:
+            continue
+    return None, None
+
+
+def read_statement_csv(path):
+    """Read a bank / UPI statement export into a list of credit transactions."""
+    with open(path, newline="", encoding="utf-8-sig") as fh:
+        reader = csv.DictReader(fh)
+        headers = {h.strip().lower(): h for h in (reader.fieldnames or [])}
+        cols = {}
+        for key, aliases in STATEMENT_COLUMNS.items():
+            cols[key] = next((headers[a] for a in aliases if a in headers), None)
+        if not cols["amount"] or not cols["time"]:
+            raise ValueError("Statement must have a date and an amount column")
+
+        txns = []
+        # an export uses one date format throughout, so try the last hit first
+        formats = STATEMENT_DATE_FORMATS
+        for line_no, row in enumerate(reader, start=2):
+            try:
+                amount = to_paise(row.get(cols["amount"]))
+            except ValueError:
+                continue
+            if amount <= 0:
+                # debits / blank credit cells are not customer payments
+                continue
+            remarks = row.get(cols["ref"], "") if cols["ref"] else ""
+            m = ORDER_REF_RE.search((remarks or "").upper())
+            when, fmt = _parse_statement_time(row.get(cols["time"]), formats)
+            if fmt and fmt != formats[0]:
+                formats = (fmt,) + tuple(f for f in STATEMENT_DATE_FORMATS if f != fmt)
+            txns.append({
+                "line": line_no,
+                "time": when,
+                # many exports carry only the date; those match anywhere in that day
+                "has_time": bool(fmt) and "%H" in fmt,
+                "amount": amount,
+                "ref": m.group(0) if m else None,
+                "upi_id": (row.get(cols["upi"], "") if cols["upi"] else "").strip(),
+                "remarks": remarks,
+            })
+    return txns
+
+
+def reconcile_transactions(txns, orders, window_minutes=RECON_WINDOW_MINUTES):
+    """
+    Match statement transactions to Online orders.
+    orders: dicts with id, order_ref, upi_id, price_paise, created_at.
+    Pass 1 joins on order reference (+ amount check); pass 2 joins the rest on
+    (amount, time bucket) looking at neighbouring buckets only, or on
+    (amount, day) when the statement line has no time of day, so both passes
+    are hash lookups per transaction.
+    """
+    by_ref = {}
+    for o in orders:
+        if o.get("order_ref"):
+            by_ref[o["order_ref"]] = o
+
+    matched = []
+    used = set()
+    leftover = []
+    for t in txns:
+        o = by_ref.get(t["ref"]) if t["ref"] else None
+        if o is not None and o["id"] not in used and o["price_paise"] == t["amount"]:
+            used.add(o["id"])
+            matched.append((t, o, "reference"))
+        else:
+            leftover.append(t)
+
+    # amount + time window index over the still-open orders
+    window = max(1, int(window_minutes)) * 60
+    buckets = {}
+    by_day = {}
+    for o in orders:
+        if o["id"] in used or not o.get("created_at"):
+            continue
+        key = (o["price_paise"], int(o["created_at"].timestamp()) // window)
+        buckets.setdefault(key, []).append(o)
+        by_day.setdefault((o["price_paise"], o["created_at"].date()), []).append(o)
+
+    unmatched_txns = []
+    for t in leftover:
+        best = None
+        if t["time"] is not None:
+            ts = t["time"].timestamp()
+            if t.get("has_time", True):
+                b = int(ts) // window
+                candidates = [o for k in (b - 1, b, b + 1) for o in buckets.get((t["amount"], k), ())]
+            else:
+                candidates = by_day.get((t["amount"], t["time"].date()), ())
+            for o in candidates:
+                if o["id"] in used:
+                    continue
+                if t.get("has_time", True):
+                    gap = abs(o["created_at"].timestamp() - ts)
+                    if gap > window:
+                        continue
+                else:
+                    # date-only line: any time that day; earliest open order first
+                    gap = o["created_at"].timestamp()
+                # prefer the payer's UPI ID when the statement carries it
+                same_upi = bool(t["upi_id"]) and t["upi_id"].lower() == (o.get("upi_id") or "").lower()
+                score = (not same_upi, gap)
+                if best is None or score < best[0]:
+                    best = (score, o)
+        if best:
+            used.add(best[1]["id"])
+            matched.append((t, best[1], "amount+time"))
+        else:
+            unmatched_txns.append(t)
+
+    unmatched_orders = [o for o in orders if o["id"] not in used]
+    return {"matched": matched, "unmatched_txns": unmatched_txns, "unmatched_orders": unmatched_orders}
+
+
+def fetch_online_orders(start_date, end_date):
+    return fetch_orders("id, student_id, order_ref, upi_id, price_paise, created_at",
+                        "payment_method='Online'", start=start_date, end=end_date, dictionary=True)
+
+# -------------------------
+# STOCK LEDGER (sharded daily counters)
+# -------------------------
+# item_stock(item_name, stock_date, shard, available, sold); an item with no rows
+# for the day is not stock-controlled. Each take is a conditional UPDATE plus a
+# stock_reservations row in one short transaction; release / commit / the expiry
+# sweep settle a reservation only if they are the one that deletes its row, so
+# units are never returned or sold twice.
+RESERVATION_TTL = 20 * 60        # seconds before an unsettled reservation is swept back into stock
+
+
+def _take_stock(db, cur, name, day, shard, qty):
+    """Reserve qty units from one shard; returns the reservation id or None."""
+    cur.execute("UPDATE item_stock SET available=available-%s "
+                "WHERE item_name=%s AND stock_date=%s AND shard=%s AND available>=%s",
+                (qty, name, day, shard, qty))
+    if cur.rowcount != 1:
+        db.rollback()
+        return None
+    cur.execute("INSERT INTO stock_reservations (item_name, stock_date, shard, qty, reserved_at) "
+                "VALUES (%s, %s, %s, %s, NOW())", (name, day, shard, qty))
+    res_id = cur.lastrowid
+    db.commit()
+    return res_id
+
+
+def _settle(db, cur, res_id, name, day, shard, qty, column):
+    """Close a reservation, adding its units to `available` or `sold`. False if already settled."""
+    cur.execute("DELETE FROM stock_reservations WHERE id=%s", (res_id,))
+    if cur.rowcount == 1:
+        cur.execute(f"UPDATE item_stock SET {column}={column}+%s "
+                    "WHERE item_name=%s AND stock_date=%s AND shard=%s", (qty, name, day, shard))
+    settled = cur.rowcount == 1
+    db.commit()
+    return settled
+
+
+def reserve_stock(items, day=None):
+    """
+    Take stock for cart items [(name, paise)]. Returns a reservation for
+    commit_stock / release_stock; raises ValueError naming what is sold out
+    (after putting back anything already taken).
+    """
+    day = day or date.today()
+    counts = Counter(name for name, _ in items)
+    db = get_db()
+    cur = db.cursor()
+    taken = []
+    try:
+        marks = ",".join(["%s"] * len(counts))
+        cur.execute(f"SELECT item_name, shard FROM item_stock WHERE stock_date=%s AND item_name IN ({marks})",
+                    [day] + list(counts))
+        shards = {}
+        for name, shard in cur.fetchall():
+            shards.setdefault(name, []).append(shard)
+        db.commit()
+
+        short = []
+        for name, qty in counts.items():
+            if name not in shards:
+                continue
+            # random starting shard spreads terminals over different rows
+            order = shards[name]
+            k = random.randrange(len(order))
+            order = order[k:] + order[:k]
+            need = qty
+            for shard in order:
+                res_id = _take_stock(db, cur, name, day, shard, need)
+                if res_id is not None:
+                    taken.append((name, shard, need, res_id))
+                    need = 0
+                    break
+            # no single shard has enough: collect it one unit at a time
+            for shard in order:
+                while need:
+                    res_id = _take_stock(db, cur, name, day, shard, 1)
+                    if res_id is None:
+                        break
+                    taken.append((name, shard, 1, res_id))
+                    need -= 1
+            if need:
+                short.append(name)
+        if short:
+            for name, shard, qty, res_id in taken:
+                _settle(db, cur, res_id, name, day, shard, qty, "available")
+            raise ValueError("Sold out: " + ", ".join(short))
+        return {"day": day, "lines": taken}
+    except ValueError:
+        raise
+    except Exception:
+        # e.g. stock_reservations missing: give back what was taken, then fail
+        db.rollback()
+        for name, shard, qty, res_id in taken:
+            try:
+                _settle(db, cur, res_id, name, day, shard, qty, "available")
+            except Exception:
+                pass
+        raise
+    finally:
+        cur.close()
+        db.close()
+
+
+def release_stock(reservation):
+    """Put reserved stock back (order discarded, payment window or app closed)."""
+    if not reservation or not reservation["lines"]:
+        return
+    db = get_db()
+    cur = db.cursor()
+    try:
+        for name, shard, qty, res_id in reservation["lines"]:
+            _settle(db, cur, res_id, name, reservation["day"], shard, qty, "available")
+    finally:
+        cur.close()
+        db.close()
+    note_write("menu")
+
+
+def commit_stock(reservation):
+    """Order placed: the reserved units become sold."""
+    if not reservation or not reservation["lines"]:
+        return
+    db = get_db()
+    cur = db.cursor()
+    day = reservation["day"]
+    try:
+        for name, shard, qty, res_id in reservation["lines"]:
+            if _settle(db, cur, res_id, name, day, shard, qty, "sold"):
+                continue
+            # swept back after RESERVATION_TTL: take the units again if still there;
+            # the order is paid either way, so it is counted as sold
+            cur.execute("UPDATE item_stock SET available=available-%s, sold=sold+%s "
+                        "WHERE item_name=%s AND stock_date=%s AND shard=%s AND available>=%s",
+                        (qty, qty, name, day, shard, qty))
+            if cur.rowcount != 1:
+                cur.execute("UPDATE item_stock SET sold=sold+%s WHERE item_name=%s AND stock_date=%s AND shard=%s",
+                            (qty, name, day, shard))
+            db.commit()
+    finally:
+        cur.close()
+        db.close()
+    note_write("menu")
+
+
+def sweep_reservations(ttl=RESERVATION_TTL, limit=200):
+    """
+    Return reservations older than ttl (terminal closed or crashed mid-order)
+    to stock. Any terminal may run it; returns how many were returned.
+    """
+    db = get_db()
+    cur = db.cursor()
+    returned = 0
+    try:
+        cur.execute("SELECT id, item_name, stock_date, shard, qty FROM stock_reservations "
+                    "WHERE reserved_at < NOW() - INTERVAL %s SECOND ORDER BY id LIMIT %s", (int(ttl), limit))
+        rows = cur.fetchall()
+        db.commit()
+        for res_id, name, day, shard, qty in rows:
+            if _settle(db, cur, res_id, name, day, shard, qty, "available"):
+                returned += 1
+    finally:
+        cur.close()
+        db.close()
+    if returned:
+        note_write("menu")
+    return returned
+
+
+def set_daily_stock(name, total, day=None):
+    """
+    Set an item's total for the day: units already sold and units reserved by
+    open orders count towards it, the rest is spread evenly over STOCK_SHARDS
+    rows. Returns (available, sold, reserved) as written.
+    """
+    day = day or date.today()
+    db = get_db()
+    cur = db.cursor()
+    try:
+        # shard rows stay locked until commit, so no take / release / sale lands in between
+        cur.execute("SELECT shard, sold FROM item_stock WHERE item_name=%s AND stock_date=%s FOR UPDATE",
+                    (name, day))
+        sold = sum(r[1] for r in cur.fetchall())
+        # plain read: a release still in flight is counted here and adds its units after our commit
+        cur.execute("SELECT IFNULL(SUM(qty), 0) FROM stock_reservations WHERE item_name=%s AND stock_date=%s",
+                    (name, day))
+        reserved = int(cur.fetchone()[0])
+        available = max(0, int(total) - sold - reserved)
+        base, extra = divmod(available, STOCK_SHARDS)
+        for shard in range(STOCK_SHARDS):
+            cur.execute("INSERT INTO item_stock (item_name, stock_date, shard, available, sold) "
+                        "VALUES (%s, %s, %s, %s, 0) ON DUPLICATE KEY UPDATE available=VALUES(available)",
+                        (name, day, shard, base + (1 if shard < extra else 0)))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cur.close()
+        db.close()
+    note_write("menu")
+    return available, sold, reserved
+
+
+def clear_daily_stock(name, day=None):
+    """Stop tracking stock for an item today (unlimited again)."""
+    db = get_db()
+    cur = db.cursor()
+    try:
+        cur.execute("DELETE FROM item_stock WHERE item_name=%s AND stock_date=%s", (name, day or date.today()))
+        cur.execute("DELETE FROM stock_reservations WHERE item_name=%s AND stock_date=%s", (name, day or date.today()))
+        db.commit()
+    finally:
+        cur.close()
+        db.close()
+    note_write("menu")
+
+
+def fetch_stock_levels(day=None):
+    """{item_name: units left today} for stock-controlled items ({} without DB / table)."""
+    if not MYSQL_AVAILABLE:
+        return {}
+    try:
+        db = get_db(read=True, key="menu")
+        cur = db.cursor()
+        cur.execute("SELECT item_name, SUM(available) FROM item_stock WHERE stock_date=%s GROUP BY item_name",
+                    (day or date.today(),))
+        rows = cur.fetchall()
+        cur.close()
+        db.close()
+    except Exception:
+        return {}
+    return {name: int(left) for name, left in rows}
+
+# -------------------------
+# RECEIPTS + PRINT SPOOLER
+# -------------------------
+def receipt_lines(order, width=RECEIPT_WIDTH, currency="Rs."):
+    """
+    Layout of a receipt as (text, style) lines; style is "" / "center" / "bold".
+    order: name, student_id, items [(name, paise)], total, payment_mode, upi_id, order_ref, when.
+    """
+    rule = "-" * width
+    lines = [("NAVRACHANA CANTEEN", "bold"), ("Navrachana University", "center"),
+             (order["when"].strftime("%d-%m-%Y %H:%M"), "center"), (rule, "")]
+    lines.append((f"Name: {order['name']}"[:width], ""))
+    lines.append((f"ID: {order['student_id']}"[:width], ""))
+    lines.append((rule, ""))
+    for item, paise in order["items"]:
+        price = rupees(paise)
+        lines.append((f"{item[:width - len(price) - 1]:<{width - len(price)}}{price}", ""))
+    lines.append((rule, ""))
+    total = f"{currency} {rupees(order['total'])}"
+    lines.append((f"{'TOTAL':<{width - len(total)}}{total}", "bold"))
+    lines.append((f"Paid: {order['payment_mode']}"[:width], ""))
+    if order.get("upi_id"):
+        lines.append((f"UPI: {order['upi_id']}"[:width], ""))
+    if order.get("order_ref"):
+        lines.append((f"Ref: {order['order_ref']}", ""))
+    lines.append(("Thank You!", "center"))
+    return lines
+
+
+def render_receipt_text(order, width=RECEIPT_WIDTH):
+    out = []
+    for text, style in receipt_lines(order, width, currency="₹"):
+        out.append(text.center(width).rstrip() if style in ("center", "bold") else text)
+    return "\n".join(out) + "\n"
+
+
+def render_receipt_escpos(order, width=RECEIPT_WIDTH):
+    ESC, GS = b"\x1b", b"\x1d"
+    data = bytearray(ESC + b"@")                         # init
+    for text, style in receipt_lines(order, width):     # "Rs." - printer code pages have no ₹
+        data += ESC + b"a" + (b"\x01" if style in ("center", "bold") else b"\x00")
+        data += ESC + b"E" + (b"\x01" if style == "bold" else b"\x00")
+        data += text.encode("ascii", "replace") + b"\n"
+    data += ESC + b"E\x00" + ESC + b"a\x00"
+    data += GS + b"V\x42\x03"                           # feed 3 lines + partial cut
+    return bytes(data)
+
+
+def _send_to_printer(data, target):
+    if isinstance(target, (tuple, list)):
+        with socket.create_connection(tuple(target), timeout=5) as conn:
+            conn.sendall(data)
+    else:
+        with open(target, "wb") as dev:
+            dev.write(data)
+
+
+class ReceiptSpooler:
+    """
+    Queue of receipts handled by one worker thread: each job writes the text
+    receipt to RECEIPT_DIR and, if RECEIPT_PRINTER is set, sends ESC/POS bytes,
+    retrying with backoff. The worker starts on the first submit. A receipt that
+    still fails is kept once in `failed` with only the steps that failed, so a
+    retry never prints a second paper copy.
+    """
+
+    STEPS = ("file", "print")
+
+    def __init__(self, printer=None, directory=None, retries=RECEIPT_RETRIES, delay=RECEIPT_RETRY_DELAY):
+        self.printer = printer
+        self.directory = directory
+        self.retries = retries
+        self.delay = delay
+        self.failed = []            # (order, failed steps, last error); guarded by _lock
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, order, steps=STEPS):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._queue.put((order, tuple(steps)))
+
+    def pending(self):
+        return self._queue.unfinished_tasks
+
+    def failed_count(self):
+        with self._lock:
+            return len(self.failed)
+
+    def retry_failed(self):
+        with self._lock:
+            failed, self.failed = self.failed, []
+        for order, steps, _ in failed:
+            self.submit(order, steps)
+        return len(failed)
+
+    def _run(self):
+        while True:
+            order, steps = self._queue.get()
+            try:
+                self._process(order, steps)
+            finally:
+                self._queue.task_done()
+
+    def _process(self, order, steps=STEPS):
+        printer = self.printer if self.printer is not None else RECEIPT_PRINTER
+        directory = self.directory or RECEIPT_DIR
+        name = order.get("order_ref") or f"{order['student_id']}_{order['when']:%Y%m%d_%H%M%S%f}"
+        # student IDs may contain / or \ - keep the receipt inside RECEIPT_DIR
+        name = re.sub(r"[^\w-]", "_", name)
+        actions = {"file": lambda: self._save(directory, name, render_receipt_text(order))}
+        if printer:
+            actions["print"] = lambda: _send_to_printer(render_receipt_escpos(order), printer)
+        failed, error = [], None
+        for step in steps:
+            if step not in actions:
+                continue
+            delay = self.delay
+            for attempt in range(self.retries):
+                try:
+                    actions[step]()
+                    break
+                except Exception as e:
+                    if attempt == self.retries - 1:
+                        failed.append(step)
+                        error = e
+                    else:
+                        time.sleep(delay)
+                        delay *= 2
+        if failed:
+            with self._lock:
+                self.failed.append((order, tuple(failed), error))
+
+    @staticmethod
+    def _save(directory, name, text):
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{name}.txt"), "w", encoding="utf-8") as fh:
+            fh.write(text)
+
+
+SPOOLER = ReceiptSpooler()
+
+# -------------------------
+# MENU + BACKGROUND LOADERS (safe to run on a worker thread)
+# -------------------------
+# sample fallback menu
+# (name, price in paise, category)
+SAMPLE_MENU = [
+    ("Veg Sandwich", 4000, "Fast Food"),
+    ("Cheese Burger", 7000, "Fast Food"),
+    ("French Fries", 5000, "Fast Food"),
+    ("Cold Coffee", 4500, "Beverage"),
+    ("Tea", 1500, "Beverage"),
+    ("Samosa", 2000, "Fast Food"),
+    ("Momos", 6000, "Fast Food"),
+    ("Cold Drink", 3000, "Beverage"),
+    ("Pav Bhaji", 8000, "Fast Food"),
+    ("Mineral Water", 2000, "Beverage"),
+]
+
+
+def fetch_menu_rows():
+    if MYSQL_AVAILABLE:
+        try:
+            db = get_db(read=True, key="menu")
+            cur = db.cursor()
+            cur.execute("SELECT name, price_paise, category FROM menu_items")
+            rows = cur.fetchall()
+            cur.close()
+            db.close()
+            return rows
+        except Exception:
+            # fall back to sample if DB fails
+            pass
+    return list(SAMPLE_MENU)
+
+
+def blurred_backgrounds():
+    """Blurred 'nuv.png' watermarks for the left/right panels as PIL images ({} if unavailable)."""
+    if not QR_LIBS_AVAILABLE:
+        return {}
+    try:
+        Image = lazy_import("PIL.Image")
+        ImageFilter = lazy_import("PIL.ImageFilter")
+        src = Image.open("nuv.png")
+        images = {}
+        for side, size in (("left", (LEFT_W, LEFT_H)), ("right", (RIGHT_W, RIGHT_H))):
+            img = src.resize(size).filter(ImageFilter.GaussianBlur(6))
+            img.putalpha(120)
+            images[side] = img
+        return images
+    except Exception:
+        # silently continue if image not found
+        return {}
 
 # -------------------------
 # APP CLASS
@@ -68,6 +1166,7 @@ class CanteenApp:
             self.w.iconbitmap("nuv.ico")
         except Exception:
             pass
+        self.w.protocol("WM_DELETE_WINDOW", self.on_close)
 
         # State
         self.current_user = None
@@ -75,11 +1174,66 @@ class CanteenApp:
         self.pending_order = None
         self.upi_id = ""   # store entered upi id during payment
         self.dark_mode = False
-
-        # Build UI
-        self.build_layout()
-        self.load_menu()
-        self.load_week_thali_menu()
+        self.archive_thread = None
+        self.menu_rows = []
+        self.stock_levels = {}   # item name -> units left today (stock-controlled items only)
+
+        # Build UI: the shell first, then the slower panels
+        with PROFILER.phase("layout"):
+            self.build_layout()
+        if FAST_START:
+            self.w.after_idle(self._fill_panels)
+        else:
+            with PROFILER.phase("thali menu"):
+                self.load_week_thali_menu()
+            with PROFILER.phase("menu"):
+                self.load_menu()
+            with PROFILER.phase("backgrounds"):
+                self.show_backgrounds(blurred_backgrounds())
+            self._startup_done()
+
+        # move old orders out of the live table once the UI is up
+        if MYSQL_AVAILABLE:
+            self.w.after(5000, self.start_archiving)
+            self.w.after(STOCK_REFRESH_MS, self._stock_refresh_loop)
+
+    def _fill_panels(self):
+        # runs once the empty shell has been drawn; DB and image work go to threads
+        PROFILER.mark("first frame")
+        with PROFILER.phase("thali menu"):
+            self.load_week_thali_menu()
+        pending = {"menu", "backgrounds"}
+
+        def finished(part):
+            pending.discard(part)
+            if not pending:
+                self._startup_done()
+
+        def menu_done(result, error):
+            rows, self.stock_levels = result or (SAMPLE_MENU, {})
+            with PROFILER.phase("menu fill"):
+                self.show_menu(rows)
+            finished("menu")
+
+        def backgrounds_done(images, error):
+            with PROFILER.phase("backgrounds fill"):
+                self.show_backgrounds(images or {})
+            finished("backgrounds")
+
+        self._run_background(lambda: (fetch_menu_rows(), fetch_stock_levels()), menu_done, interval=20)
+        self._run_background(blurred_backgrounds, backgrounds_done, interval=20)
+
+    def _startup_done(self):
+        PROFILER.mark("interactive")
+        if not PROFILE_STARTUP:
+            return
+        report = PROFILER.report()
+        print(report)
+        try:
+            with open(STARTUP_PROFILE_LOG, "a", encoding="utf-8") as fh:
+                fh.write(f"# {datetime.now():%Y-%m-%d %H:%M:%S} fast_start={FAST_START}\n{report}\n\n")
+        except OSError:
+            pass
 
     # -------------------------
     # UI: layout
@@ -100,8 +1254,6 @@ class CanteenApp:
         # Left panel
         self.left = tk.Frame(container, bg="lightblue", bd=2, relief="groove")
         self.left.place(x=90, y=20, width=LEFT_W, height=LEFT_H)
-        # apply background watermark
-        self.apply_left_background()
 
         tk.Label(self.left, text="Weekly Thali Menu", bg="#0984e3",
                  fg="white", font=("Arial", 13, "bold"), pady=4).pack(fill="x")
@@ -119,10 +1271,12 @@ class CanteenApp:
         menu_frame = tk.Frame(self.left, bg="white")
         menu_frame.pack(fill="both", expand=True, padx=8, pady=6)
 
-        self.menu_tree = ttk.Treeview(menu_frame, columns=("name", "price", "category"), show="headings")
-        for c, h in zip(("name", "price", "category"), ("Item Name", "Price ₹", "Category")):
+        self.menu_tree = ttk.Treeview(menu_frame, columns=("name", "price", "category", "left"), show="headings")
+        for c, h, wdt in zip(("name", "price", "category", "left"), ("Item Name", "Price ₹", "Category", "Left"),
+                             (160, 90, 120, 70)):
             self.menu_tree.heading(c, text=h)
-            self.menu_tree.column(c, width=150)
+            self.menu_tree.column(c, width=wdt)
+        self.menu_tree.tag_configure("soldout", foreground="gray")
         self.menu_tree.pack(side="left", fill="both", expand=True)
 
         scrollbar = ttk.Scrollbar(menu_frame, orient="vertical", command=self.menu_tree.yview)
@@ -133,7 +1287,6 @@ class CanteenApp:
         # Right panel
         self.right = tk.Frame(container, bg="lightblue", bd=2, relief="groove")
         self.right.place(x=650, y=20, width=RIGHT_W, height=RIGHT_H)
-        self.apply_right_background()
 
         # right content (login UI initially)
         self.login_ui()
@@ -148,27 +1301,22 @@ class CanteenApp:
         self.lift_children(self.left)
         self.lift_children(self.right)
 
-    def apply_left_background(self):
+    def show_backgrounds(self, images):
+        # images from blurred_backgrounds(); PhotoImage must be made on the UI thread
         try:
-            if QR_LIBS_AVAILABLE:
-                img = Image.open("nuv.png").resize((LEFT_W, LEFT_H)).filter(ImageFilter.GaussianBlur(6))
-                img.putalpha(120)
-                self.left_bg_img = ImageTk.PhotoImage(img)
+            ImageTk = lazy_import("PIL.ImageTk")
+            if "left" in images:
+                self.left_bg_img = ImageTk.PhotoImage(images["left"])
                 lbl = tk.Label(self.left, image=self.left_bg_img)
                 lbl.place(x=0, y=0, relwidth=1, relheight=1)
-        except Exception:
-            # silently continue if image not found or pillow missing
-            pass
-
-    def apply_right_background(self):
-        try:
-            if QR_LIBS_AVAILABLE:
-                img = Image.open("nuv.png").resize((RIGHT_W, RIGHT_H)).filter(ImageFilter.GaussianBlur(6))
-                img.putalpha(120)
-                self.right_bg_img = ImageTk.PhotoImage(img)
+                lbl.lower()
+            if "right" in images:
+                self.right_bg_img = ImageTk.PhotoImage(images["right"])
                 lbl = tk.Label(self.right, image=self.right_bg_img)
                 lbl.place(x=0, y=0, relwidth=1, relheight=1)
+                lbl.lower()
         except Exception:
+            # silently continue if pillow missing
             pass
 
     def lift_children(self, frame):
@@ -198,8 +1346,9 @@ class CanteenApp:
         self.sid.grid(row=0, column=1, pady=6)
         self.passw.grid(row=1, column=1, pady=6)
 
-        tk.Button(frm, text="Login", bg="#0984e3", fg="white",font=("arial",11),width=20,
-                  command=self.login).grid(row=2, column=0, columnspan=2, pady=10)
+        self.login_btn = tk.Button(frm, text="Login", bg="#0984e3", fg="white",font=("arial",11),width=20,
+                                   command=self.login)
+        self.login_btn.grid(row=2, column=0, columnspan=2, pady=10)
         tk.Button(frm, text="Signup", bg="#00b894", fg="white",font=("arial",11),width=20,
                   command=self.signup_ui).grid(row=3, column=0, columnspan=2, pady=5)
 
@@ -232,35 +1381,84 @@ class CanteenApp:
             if not MYSQL_AVAILABLE:
                 messagebox.showerror("DB Error", "MySQL connector not available. Signup disabled.")
                 return
-            db = get_db()
-            cur = db.cursor()
-            cur.execute("INSERT INTO users(name, student_id, phone, password) VALUES(%s,%s,%s,%s)",
-                        (name.get(), sid.get(), phone.get(), pwd.get()))
-            db.commit()
-            cur.close()
-            db.close()
-            messagebox.showinfo("Success", "Signup successful! Please login.")
-            self.login_ui()
+            values = (name.get().strip(), sid.get().strip(), phone.get().strip(), pwd.get())
+            if not values[1] or not values[3]:
+                messagebox.showerror("Error", "Student ID and password are required")
+                return
+            register_btn.config(state="disabled")
+
+            def done(result, error):
+                if register_btn.winfo_exists():
+                    register_btn.config(state="normal")
+                if isinstance(error, ValueError):
+                    messagebox.showerror("Signup", str(error))
+                elif error:
+                    messagebox.showerror("DB Error", f"Signup failed:\n{error}")
+                else:
+                    messagebox.showinfo("Success", "Signup successful! Please login.")
+                    self.login_ui()
+
+            # hashing is deliberately slow; keep it off the UI thread
+            self._run_background(lambda: USERS.register(*values), done)
 
-        tk.Button(f, text="Register", bg="#00b894", fg="white",font=("arial",11),width="20" ,command=save_signup).grid(row=4, column=0, columnspan=2, pady=20)
+        register_btn = tk.Button(f, text="Register", bg="#00b894", fg="white",font=("arial",11),width="20" ,command=save_signup)
+        register_btn.grid(row=4, column=0, columnspan=2, pady=20)
 
     def login(self):
         if not MYSQL_AVAILABLE:
             messagebox.showerror("DB Error", "MySQL connector not available. Login disabled.")
             return
-        sid = self.sid.get()
+        sid = self.sid.get().strip()
         pw = self.passw.get()
-        db = get_db()
-        cur = db.cursor(dictionary=True)
-        cur.execute("SELECT * FROM users WHERE student_id=%s AND password=%s", (sid, pw))
-        user = cur.fetchone()
-        cur.close()
-        db.close()
-        if user:
-            self.current_user = user
-            self.after_login_ui()
-        else:
-            messagebox.showerror("Error", "Invalid ID or password")
+        self.login_btn.config(state="disabled")
+
+        def done(user, error):
+            if self.login_btn.winfo_exists():
+                self.login_btn.config(state="normal")
+            if error:
+                messagebox.showerror("DB Error", f"Login failed:\n{error}")
+            elif user:
+                self.current_user = user
+                self.after_login_ui()
+            else:
+                messagebox.showerror("Error", "Invalid ID or password")
+
+        self._run_background(lambda: USERS.authenticate(sid, pw), done)
+
+    def logout(self):
+        # next student at this terminal; the session cache keeps this student's
+        # login for SESSION_TTL so coming back skips the DB and the KDF
+        self._release_pending()
+        self.cart_items.clear()
+        self.current_user = None
+        self.login_ui()
+        self.lift_children(self.right)
+
+    def _run_background(self, work, done, interval=50):
+        """
+        Run work() on a daemon thread and call done(result, error) back on the
+        UI thread (tkinter is not thread-safe, so we poll with after()).
+        Returns the thread.
+        """
+        box = {}
+
+        def target():
+            try:
+                box["result"] = work()
+            except Exception as e:
+                box["error"] = e
+
+        t = threading.Thread(target=target, daemon=True)
+        t.start()
+
+        def poll():
+            if t.is_alive():
+                self.w.after(interval, poll)
+            else:
+                done(box.get("result"), box.get("error"))
+
+        self.w.after(interval, poll)
+        return t
 
     # -------------------------
     # AFTER LOGIN UI (Cart etc.)
@@ -269,8 +1467,11 @@ class CanteenApp:
         for widget in self.right.winfo_children():
             widget.destroy()
 
-        tk.Label(self.right, text=f"Welcome, {self.current_user['name']}",
-                 bg="#6c5ce7", fg="white", font=("Arial", 13, "bold")).pack(fill="x")
+        welcome = tk.Label(self.right, text=f"Welcome, {self.current_user['name']}",
+                           bg="#6c5ce7", fg="white", font=("Arial", 13, "bold"))
+        welcome.pack(fill="x")
+        tk.Button(welcome, text="Logout", bg="#d63031", fg="white", font=("Arial", 9, "bold"),
+                  command=self.logout).place(relx=1.0, x=-4, rely=0.5, anchor="e")
 
         frame_top = tk.Frame(self.right, bg="white")
         frame_top.pack(pady=10)
@@ -279,8 +1480,8 @@ class CanteenApp:
                  font=("Arial", 12, "bold")).grid(row=0, column=0, padx=8)
 
         self.thali_choice = tk.StringVar()
-        tk.Radiobutton(frame_top, text="Half (₹40)", variable=self.thali_choice, value="Half", bg="white").grid(row=0, column=1)
-        tk.Radiobutton(frame_top, text="Full (₹70)", variable=self.thali_choice, value="Full", bg="white").grid(row=0, column=2)
+        tk.Radiobutton(frame_top, text=f"Half (₹{THALI_PRICES['Half'] // 100})", variable=self.thali_choice, value="Half", bg="white").grid(row=0, column=1)
+        tk.Radiobutton(frame_top, text=f"Full (₹{THALI_PRICES['Full'] // 100})", variable=self.thali_choice, value="Full", bg="white").grid(row=0, column=2)
         tk.Button(frame_top, text="Add Thali", bg="#0984e3", fg="white",
                   command=self.add_thali).grid(row=0, column=3, padx=10)
 
@@ -297,8 +1498,9 @@ class CanteenApp:
         tk.Button(self.right, text="Remove Selected", bg="#d63031", fg="white",font=("Arial", 15, "bold"), width="20",
                   command=self.remove_item).pack(pady=5)
 
-        tk.Button(self.right, text="Place Order", bg="#00b894", fg="white", width="20",
-                  font=("Arial", 15, "bold"), command=self.place_order).pack(pady=8)
+        self.place_btn = tk.Button(self.right, text="Place Order", bg="#00b894", fg="white", width="20",
+                                   font=("Arial", 15, "bold"), command=self.place_order)
+        self.place_btn.pack(pady=8)
 
         tk.Button(self.right, text="View History", bg="#0984e3", fg="white", width="20",
                   font=("Arial", 15, "bold"), command=self.show_history).pack(pady=5)
@@ -311,17 +1513,26 @@ class CanteenApp:
     def add_selected_item(self, event):
         item = self.menu_tree.item(self.menu_tree.focus())["values"]
         if item:
-            self.cart_items.append((item[0], float(item[1])))
-            self.cart_tree.insert("", "end", values=(item[0], item[1]))
+            left = self._stock_left(item[0])
+            if left is not None and left <= 0:
+                messagebox.showinfo("Sold Out", f"{item[0]} is sold out for today.")
+                return
+            price = to_paise(item[1])
+            self.cart_items.append((item[0], price))
+            self.cart_tree.insert("", "end", values=(item[0], rupees(price)))
 
     def add_thali(self):
         choice = self.thali_choice.get()
         if not choice:
             messagebox.showerror("Error", "Please select Half or Full thali")
             return
-        price = 40 if choice == "Half" else 70
+        left = self._stock_left(f"{choice} Thali")
+        if left is not None and left <= 0:
+            messagebox.showinfo("Sold Out", f"{choice} Thali is sold out for today.")
+            return
+        price = THALI_PRICES[choice]
         self.cart_items.append((f"{choice} Thali", price))
-        self.cart_tree.insert("", "end", values=(f"{choice} Thali", price))
+        self.cart_tree.insert("", "end", values=(f"{choice} Thali", rupees(price)))
 
     def remove_item(self):
         selected = self.cart_tree.selection()
@@ -337,12 +1548,59 @@ class CanteenApp:
         if not self.cart_items:
             messagebox.showerror("Empty", "Please add items first")
             return
-        total = sum(i[1] for i in self.cart_items)
-        self.pending_order = {
-            "items": list(self.cart_items),
-            "total": total
-        }
-        self.open_confirm_dialog()
+        total = sum(i[1] for i in self.cart_items)    # int paise
+        items = list(self.cart_items)
+        # an earlier order left open (dialog closed some other way) gives its stock back
+        self._release_pending()
+        # one reservation at a time: a second click would orphan the first one's stock
+        self.place_btn.config(state="disabled")
+        user = self.current_user
+
+        def reserved(reservation, error):
+            if self.place_btn.winfo_exists():
+                self.place_btn.config(state="normal")
+            if self.current_user is not user:
+                # logged out while reserving
+                if reservation:
+                    self._run_background(lambda: release_stock(reservation), lambda r, e: self.refresh_stock())
+                return
+            if isinstance(error, ValueError):
+                messagebox.showerror("Sold Out", f"{error}\nPlease remove it from your cart.")
+                self.refresh_stock()
+                return
+            # other errors: stock table missing / DB down -> order without stock control
+            self.pending_order = {
+                "items": items,
+                "total": total,
+                "ref": new_order_ref(),
+                "reservation": reservation,
+            }
+            self.open_confirm_dialog()
+
+        if MYSQL_AVAILABLE:
+            self._run_background(lambda: reserve_stock(items), reserved)
+        else:
+            reserved(None, None)
+
+    def _release_pending(self):
+        # discard the pending order and return any stock it reserved
+        order, self.pending_order = self.pending_order, None
+        self.upi_id = ""
+        reservation = order.get("reservation") if order else None
+        if reservation:
+            self._run_background(lambda: release_stock(reservation), lambda r, e: self.refresh_stock())
+
+    def on_close(self):
+        # main window closed mid-order: return the reservation now (a background
+        # thread would die with the process); anything missed is swept after RESERVATION_TTL
+        order, self.pending_order = self.pending_order, None
+        reservation = order.get("reservation") if order else None
+        if reservation:
+            try:
+                release_stock(reservation)
+            except Exception:
+                pass
+        self.w.destroy()
 
     def open_confirm_dialog(self):
         dlg = Toplevel(self.w)
@@ -352,7 +1610,7 @@ class CanteenApp:
         dlg.grab_set()
 
         tk.Label(dlg, text="Confirm your order", font=("Arial", 12, "bold")).pack(pady=10)
-        tk.Label(dlg, text=f"Items: {len(self.pending_order['items'])} | Total: ₹{self.pending_order['total']}").pack(pady=5)
+        tk.Label(dlg, text=f"Items: {len(self.pending_order['items'])} | Total: ₹{rupees(self.pending_order['total'])}").pack(pady=5)
 
         btn_frame = tk.Frame(dlg)
         btn_frame.pack(pady=10)
@@ -363,7 +1621,9 @@ class CanteenApp:
 
         def discard():
             dlg.destroy()
-            self.pending_order = None
+            self._release_pending()
+
+        dlg.protocol("WM_DELETE_WINDOW", discard)
 
         tk.Button(btn_frame, text="Confirm", bg="#00b894", fg="white", width=10, command=confirm).grid(row=0, column=0, padx=8)
         tk.Button(btn_frame, text="Discard", bg="#d63031", fg="white", width=10, command=discard).grid(row=0, column=1, padx=8)
@@ -376,6 +1636,12 @@ class CanteenApp:
         dlg.iconbitmap('nuv.ico')
         dlg.grab_set()
 
+        def cancel():
+            dlg.destroy()
+            self._release_pending()
+
+        dlg.protocol("WM_DELETE_WINDOW", cancel)
+
         tk.Label(dlg, text="Payment Method", font=("Arial", 14, "bold")).pack(fill='x', pady=8)
 
         self.payment_var = tk.StringVar(value="Cash")
@@ -412,20 +1678,21 @@ class CanteenApp:
 
             if QR_LIBS_AVAILABLE:
                 # generate QR with encoded info
-                qr_text = f"NUV_CANTEEN|{self.current_user['student_id']}|AMOUNT:{total}"
-                qr = qrcode.make(qr_text)
+                qr_text = f"NUV_CANTEEN|{self.current_user['student_id']}|AMOUNT:{rupees(total)}|REF:{self.pending_order['ref']}"
+                qr = lazy_import("qrcode").make(qr_text)
                 qr_path = os.path.join(os.getcwd(), f"nuv_qr_{int(datetime.now().timestamp())}.png")
                 qr.save(qr_path)
 
                 # show QR image
                 try:
-                    img = Image.open(qr_path)
+                    img = lazy_import("PIL.Image").open(qr_path)
                     img = img.resize((240, 240))
-                    tkimg = ImageTk.PhotoImage(img)
+                    tkimg = lazy_import("PIL.ImageTk").PhotoImage(img)
                     lbl = tk.Label(self.payment_area, image=tkimg)
                     lbl.image = tkimg
                     lbl.pack(pady=6)
-                    tk.Label(self.payment_area, text=f"Amount: ₹{total}").pack()
+                    tk.Label(self.payment_area, text=f"Amount: ₹{rupees(total)}").pack()
+                    tk.Label(self.payment_area, text=f"Add to payment remarks: {self.pending_order['ref']}").pack()
                 except Exception:
                     tk.Label(self.payment_area, text="QR generated at: " + qr_path).pack()
 
@@ -471,36 +1738,70 @@ class CanteenApp:
         items = ", ".join([i[0] for i in self.pending_order['items']])
         total = self.pending_order['total']
         payment_mode = self.payment_var.get() if hasattr(self, 'payment_var') else 'Cash'
-        upi_id_for_bill = getattr(self, "upi_id", "")
-
-        # insert into DB (try with payment_method column, else fallback)
+        # take whatever is in the box now, even if "Save UPI" was never clicked
+        entry = getattr(self, "upi_id_entry", None)
+        if payment_mode == "Online" and entry is not None and entry.winfo_exists():
+            self.upi_id = entry.get().strip() or self.upi_id
+        upi_id_for_bill = getattr(self, "upi_id", "") if payment_mode == "Online" else ""
+        order_ref = self.pending_order.get('ref') if payment_mode == "Online" else None
+        now = datetime.now()
+
+        # insert into DB (try with reconciliation columns, then payment_method, else fallback)
         if MYSQL_AVAILABLE:
+            saved = False
             try:
                 db = get_db()
                 cur = db.cursor()
                 try:
                     cur.execute(
-                        "INSERT INTO orders (student_id, item_desc, price, date_for, payment_method) VALUES (%s, %s, %s, %s, %s)",
-                        (self.current_user['student_id'], items, total, datetime.now().date(), payment_mode)
+                        "INSERT INTO orders (student_id, item_desc, price_paise, date_for, payment_method, order_ref, upi_id, created_at) "
+                        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+                        (self.current_user['student_id'], items, total, now.date(), payment_mode,
+                         order_ref, upi_id_for_bill or None, now)
                     )
                 except Exception:
-                    cur.execute(
-                        "INSERT INTO orders (student_id, item_desc, price, date_for) VALUES (%s, %s, %s, %s)",
-                        (self.current_user['student_id'], items, total, datetime.now().date())
-                    )
+                    try:
+                        cur.execute(
+                            "INSERT INTO orders (student_id, item_desc, price_paise, date_for, payment_method) VALUES (%s, %s, %s, %s, %s)",
+                            (self.current_user['student_id'], items, total, now.date(), payment_mode)
+                        )
+                    except Exception:
+                        cur.execute(
+                            "INSERT INTO orders (student_id, item_desc, price_paise, date_for) VALUES (%s, %s, %s, %s)",
+                            (self.current_user['student_id'], items, total, now.date())
+                        )
                 db.commit()
                 cur.close()
                 db.close()
+                note_write(self.current_user['student_id'])
+                saved = True
             except Exception:
                 # DB failed, continue but inform user
                 messagebox.showwarning("DB", "Order saved locally (DB insert failed).")
+            # stock becomes sold only if the order row exists; otherwise put it back
+            reservation = self.pending_order.get('reservation')
+            if reservation:
+                settle = commit_stock if saved else release_stock
+                self._run_background(lambda: settle(reservation), lambda r, e: self.refresh_stock())
         else:
             # No DB library; skip DB step
             pass
 
-        # Show bill and clear cart
-        self.show_simple_bill(self.pending_order['items'], total, payment_mode, upi_id_for_bill)
+        # Queue the receipt, show bill and clear cart
+        receipt = {
+            "name": self.current_user['name'],
+            "student_id": self.current_user['student_id'],
+            "items": list(self.pending_order['items']),
+            "total": total,
+            "payment_mode": payment_mode,
+            "upi_id": upi_id_for_bill,
+            "order_ref": order_ref,
+            "when": now,
+        }
+        SPOOLER.submit(receipt)
+        self.show_simple_bill(self.pending_order['items'], total, payment_mode, upi_id_for_bill, order_ref)
         self.cart_items.clear()
+        self.upi_id = ""
         if hasattr(self, 'cart_tree'):
             for i in self.cart_tree.get_children():
                 self.cart_tree.delete(i)
@@ -509,7 +1810,7 @@ class CanteenApp:
             try: dialog_window.destroy()
             except: pass
 
-    def show_simple_bill(self, items, total, payment_mode='Cash', upi_id=""):
+    def show_simple_bill(self, items, total, payment_mode='Cash', upi_id="", order_ref=None):
         bill = Toplevel(self.w)
         bill.title("Bill - Navrachana Canteen")
         bill.geometry("410x480+500+190")
@@ -519,19 +1820,23 @@ class CanteenApp:
         except: pass
 
         bill.transient(self.w)          # main window ke saath move karega
-        bill.grab_set()                 # bill pe click force karega
         bill.lift()
+        # not modal: the printed receipt is spooled in the background, so the
+        # counter can take the next order while this is on screen
+        bill.after(BILL_AUTO_CLOSE_MS, lambda: bill.winfo_exists() and bill.destroy())
 
         tk.Label(bill, text="Navrachana Canteen", font=("Arial", 18, "bold"), bg="#f8f9fa",fg="blue").pack(pady=15)
         tk.Label(bill, text=f"Name: {self.current_user['name']}", font=("Arial", 12), bg="#f8f9fa").pack()
         tk.Label(bill, text=f"Enrollment: {self.current_user['student_id']}", font=("Arial", 12), bg="#f8f9fa").pack(pady=(0, 10))
         tk.Label(bill, text="Items Ordered:", font=("Arial", 13, "bold"), bg="#f8f9fa").pack(anchor="w", padx=30)
-        for item, price in items:
-            tk.Label(bill, text=f"• {item} - ₹{price}", font=("Arial", 11), bg="#f8f9fa").pack(anchor="w", padx=40)
-        tk.Label(bill, text=f"Total: ₹{total}", font=("Arial", 14, "bold"), bg="#f8f9fa").pack(pady=15)
+        tk.Label(bill, text="\n".join(f"• {item} - ₹{rupees(price)}" for item, price in items),
+                 font=("Arial", 11), bg="#f8f9fa", justify="left").pack(anchor="w", padx=40)
+        tk.Label(bill, text=f"Total: ₹{rupees(total)}", font=("Arial", 14, "bold"), bg="#f8f9fa").pack(pady=15)
         tk.Label(bill, text=f"Payment Mode: {payment_mode}", font=("Arial", 12), bg="#f8f9fa").pack(pady=(0, 6))
         if upi_id:
             tk.Label(bill, text=f"UPI ID: {upi_id}", font=("Arial", 11), bg="#f8f9fa").pack(pady=(0, 6))
+        if order_ref:
+            tk.Label(bill, text=f"Order Ref: {order_ref}", font=("Arial", 11), bg="#f8f9fa").pack(pady=(0, 6))
         tk.Label(bill, text="Thank You!", font=("Arial", 16, "italic"), fg="green", bg="#f8f9fa").pack(pady=10)
         tk.Button(bill, text="Close", bg="#6c757d", fg="white", command=bill.destroy).pack(pady=5)
 
@@ -561,61 +1866,91 @@ class CanteenApp:
         tree.column("price", width=100, anchor="center")
         tree.pack(fill="both", expand=True, padx=10, pady=10)
 
+        student_id = self.current_user['student_id']
+        shown_ids = set()     # ids survive archiving, so they identify an order in any table
+
+        def add_rows(rows):
+            for oid, day, desc, paise in rows:
+                if oid not in shown_ids:
+                    shown_ids.add(oid)
+                    tree.insert("", "end", values=(day, desc, rupees(paise)))
+
         if MYSQL_AVAILABLE:
             try:
-                db = get_db()
-                cur = db.cursor()
-                cur.execute("SELECT date_for, item_desc, price FROM orders WHERE student_id=%s ORDER BY date_for DESC",
-                            (self.current_user['student_id'],))
-                rows = cur.fetchall()
-                for row in rows:
-                    tree.insert("", "end", values=row)
-                cur.close()
-                db.close()
+                # recent orders only; archived months are loaded on request
+                add_rows(fetch_orders("id, date_for, item_desc, price_paise", "student_id=%s", (student_id,),
+                                      include_archive=False, order_by="date_for DESC", key=student_id))
             except Exception:
                 tree.insert("", "end", values=("—", "Could not fetch from DB", "—"))
         else:
             tree.insert("", "end", values=("—", "DB not available", "—"))
 
-        tk.Button(hist, text="Close", bg="#6c757d", fg="white", command=hist.destroy).pack(pady=5)
+        btn_frame = tk.Frame(hist, bg="black")
+        btn_frame.pack(pady=5)
+
+        def load_older():
+            try:
+                rows = fetch_orders("id, date_for, item_desc, price_paise", "student_id=%s", (student_id,),
+                                    end=archive_cutoff(), order_by="date_for DESC", key=student_id)
+            except Exception:
+                messagebox.showerror("DB", "Could not fetch archived orders", parent=hist)
+                return
+            # the live table may still hold a few old rows not yet compacted
+            add_rows(rows)
+            older_btn.config(state="disabled")
+
+        older_btn = tk.Button(btn_frame, text="Load Older Orders", bg="#0984e3", fg="white", command=load_older)
+        older_btn.pack(side="left", padx=5)
+        if not MYSQL_AVAILABLE:
+            older_btn.config(state="disabled")
+        tk.Button(btn_frame, text="Close", bg="#6c757d", fg="white", command=hist.destroy).pack(side="left", padx=5)
 
     # -------------------------
     # Load menu from DB or sample
     # -------------------------
     def load_menu(self):
+        self.stock_levels = fetch_stock_levels()
+        self.show_menu(fetch_menu_rows())
+
+    def show_menu(self, rows):
+        self.menu_rows = list(rows)
         # Clear tree
         for i in self.menu_tree.get_children():
             self.menu_tree.delete(i)
-        if MYSQL_AVAILABLE:
-            try:
-                db = get_db()
-                cur = db.cursor()
-                cur.execute("SELECT name, price, category FROM menu_items")
-                rows = cur.fetchall()
-                for r in rows:
-                    self.menu_tree.insert("", "end", values=(r[0], r[1], r[2]))
-                cur.close()
-                db.close()
-                return
-            except Exception:
-                # fall back to sample if DB fails
-                pass
+        for r in self.menu_rows:
+            left = self.stock_levels.get(r[0])
+            if left is not None and left <= 0:
+                if HIDE_SOLD_OUT:
+                    continue
+                self.menu_tree.insert("", "end", values=(r[0], rupees(r[1]), r[2], "Sold out"), tags=("soldout",))
+            else:
+                self.menu_tree.insert("", "end", values=(r[0], rupees(r[1]), r[2], "" if left is None else left))
 
-        # sample fallback menu
-        sample = [
-            ("Veg Sandwich", 40.0, "Fast Food"),
-            ("Cheese Burger", 70.0, "Fast Food"),
-            ("French Fries", 50.0, "Fast Food"),
-            ("Cold Coffee", 45.0, "Beverage"),
-            ("Tea", 15.0, "Beverage"),
-            ("Samosa", 20.0, "Fast Food"),
-            ("Momos", 60.0, "Fast Food"),
-            ("Cold Drink", 30.0, "Beverage"),
-            ("Pav Bhaji", 80.0, "Fast Food"),
-            ("Mineral Water", 20.0, "Beverage"),
-        ]
-        for it in sample:
-            self.menu_tree.insert("", "end", values=it)
+    def refresh_stock(self, sweep=False):
+        def work():
+            if sweep:
+                try:
+                    sweep_reservations()
+                except Exception:
+                    pass   # e.g. DB down; the next round retries
+            return fetch_stock_levels()
+
+        def done(levels, error):
+            if levels is not None:
+                self.stock_levels = levels
+                self.show_menu(self.menu_rows)
+        self._run_background(work, done, interval=100)
+
+    def _stock_refresh_loop(self):
+        self.refresh_stock(sweep=True)
+        self.w.after(STOCK_REFRESH_MS, self._stock_refresh_loop)
+
+    def _stock_left(self, name):
+        # None = not stock-controlled; otherwise units left after what is already in the cart
+        left = self.stock_levels.get(name)
+        if left is None:
+            return None
+        return left - sum(1 for c in self.cart_items if c[0] == name)
 
     # -------------------------
     # Weekly thali with current day highlight
@@ -679,9 +2014,9 @@ class CanteenApp:
         # load existing
         if MYSQL_AVAILABLE:
             try:
-                db = get_db(); cur = db.cursor(); cur.execute("SELECT name, price, category FROM menu_items"); rows = cur.fetchall(); cur.close(); db.close()
+                db = get_db(read=True, key="menu"); cur = db.cursor(); cur.execute("SELECT name, price_paise, category FROM menu_items"); rows = cur.fetchall(); cur.close(); db.close()
                 for r in rows:
-                    tree.insert("", "end", values=r)
+                    tree.insert("", "end", values=(r[0], rupees(r[1]), r[2]))
             except:
                 pass
 
@@ -722,7 +2057,7 @@ class CanteenApp:
                     messagebox.showerror("Error", "Price is required!")
                     return
                 try:
-                    price = float(price_text)
+                    price = to_paise(price_text)
                     if price <= 0:
                         raise ValueError
                 except:
@@ -734,17 +2069,18 @@ class CanteenApp:
                     try:
                         db = get_db()
                         cur = db.cursor()
-                        cur.execute("INSERT INTO menu_items (name, price, category) VALUES (%s, %s, %s)",
+                        cur.execute("INSERT INTO menu_items (name, price_paise, category) VALUES (%s, %s, %s)",
                                     (name, price, cat))
                         db.commit()
                         cur.close()
                         db.close()
+                        note_write("menu")
                     except Exception as e:
                         messagebox.showerror("DB Error", f"Could not save item:\n{e}")
                         return
 
                 # Add to Treeview
-                tree.insert("", "end", values=(name, price, cat))
+                tree.insert("", "end", values=(name, rupees(price), cat))
                 messagebox.showinfo("Success", f"{name} added successfully!")
                 add_dlg.destroy()
 
@@ -762,13 +2098,72 @@ class CanteenApp:
             if MYSQL_AVAILABLE:
                 # try delete from DB
                 try:
-                    db = get_db(); cur = db.cursor(); cur.execute("DELETE FROM menu_items WHERE name=%s AND price=%s LIMIT 1", (vals[0], vals[1])); db.commit(); cur.close(); db.close()
+                    db = get_db(); cur = db.cursor(); cur.execute("DELETE FROM menu_items WHERE name=%s AND price_paise=%s LIMIT 1", (vals[0], to_paise(vals[1]))); db.commit(); cur.close(); db.close()
+                    note_write("menu")
                 except:
                     pass
             tree.delete(sel[0])
 
         tk.Button(right, text="Add Menu Item", command=add_menu_item, bg="#00b894", fg="white").pack(fill="x", pady=6)
         tk.Button(right, text="Remove Selected", command=remove_menu_item, bg="#d63031", fg="white").pack(fill="x", pady=6)
+        tk.Button(right, text="Archive Old Orders", command=lambda: self.start_archiving(notify=admin), bg="#6c5ce7", fg="white").pack(fill="x", pady=6)
+        def stock_item_name():
+            # selected menu row, or a typed name (e.g. "Full Thali", which is not a menu row)
+            sel = tree.selection()
+            if sel:
+                return str(tree.item(sel[0])['values'][0])
+            return (simpledialog.askstring("Stock", "Item name (e.g. Full Thali):", parent=admin) or "").strip()
+
+        def set_stock():
+            name = stock_item_name()
+            if not name:
+                return
+            total = simpledialog.askinteger("Stock", f"Total units of {name} for today\n(including any already sold):",
+                                            parent=admin, minvalue=0)
+            if total is None:
+                return
+            try:
+                available, sold, reserved = set_daily_stock(name, total)
+            except Exception as e:
+                messagebox.showerror("DB Error", f"Could not set stock:\n{e}", parent=admin)
+                return
+            self.refresh_stock()
+            messagebox.showinfo("Stock", f"{name}: {total} for today - {sold} sold, {reserved} in open orders, "
+                                         f"{available} left.", parent=admin)
+
+        def clear_stock():
+            name = stock_item_name()
+            if not name:
+                return
+            try:
+                clear_daily_stock(name)
+            except Exception as e:
+                messagebox.showerror("DB Error", f"Could not clear stock:\n{e}", parent=admin)
+                return
+            self.refresh_stock()
+            messagebox.showinfo("Stock", f"{name} is no longer stock-limited today.", parent=admin)
+
+        tk.Button(right, text="Set Today's Stock", command=set_stock, bg="#00cec9", fg="white").pack(fill="x", pady=6)
+        tk.Button(right, text="Clear Stock Limit", command=clear_stock, bg="#b2bec3").pack(fill="x", pady=6)
+
+        def retry_receipts():
+            n = SPOOLER.retry_failed()
+            messagebox.showinfo("Receipts", f"Re-queued {n} failed receipt(s).", parent=admin)
+
+        receipt_row = tk.Frame(right)
+        receipt_row.pack(fill="x", pady=6)
+        tk.Button(receipt_row, text="Retry Failed Receipts", command=retry_receipts, bg="#fdcb6e").pack(side="left", fill="x", expand=True)
+        receipt_status = tk.Label(receipt_row, font=("Arial", 9))
+        receipt_status.pack(side="left", padx=4)
+
+        def update_receipt_status():
+            if not receipt_status.winfo_exists():
+                return
+            receipt_status.config(text=f"queued {SPOOLER.pending()} | failed {SPOOLER.failed_count()}")
+            admin.after(1000, update_receipt_status)
+
+        update_receipt_status()
+        tk.Button(right, text="Reconcile UPI Statement", command=lambda: self.open_reconciliation(admin), bg="#0984e3", fg="white").pack(fill="x", pady=6)
 
         # simple analytics: orders count & revenue (from DB if available)
         def load_analytics():
@@ -781,14 +2176,105 @@ class CanteenApp:
         tk.Label(analytics_frame, text="Order Analytics", font=("Arial", 12, "bold")).pack()
         if MYSQL_AVAILABLE:
             try:
-                db = get_db(); cur = db.cursor(); cur.execute("SELECT COUNT(*), IFNULL(SUM(price),0) FROM orders"); r = cur.fetchone(); cur.close(); db.close()
+                r = fetch_order_totals()
                 tk.Label(analytics_frame, text=f"Total Orders: {r[0]}").pack(anchor="w")
-                tk.Label(analytics_frame, text=f"Total Revenue: ₹{r[1]}").pack(anchor="w")
+                tk.Label(analytics_frame, text=f"Total Revenue: ₹{rupees(r[1])}").pack(anchor="w")
             except:
                 tk.Label(analytics_frame, text="Could not fetch analytics from DB").pack()
         else:
             tk.Label(analytics_frame, text="DB not available for analytics").pack()
 
+    # -------------------------
+    # Background order archiving
+    # -------------------------
+    def start_archiving(self, notify=None):
+        if self.archive_thread and self.archive_thread.is_alive():
+            if notify:
+                messagebox.showinfo("Archive", "Archiving is already running.", parent=notify)
+            return
+
+        def done(moved, error):
+            if not notify or not notify.winfo_exists():
+                return
+            if error:
+                messagebox.showerror("Archive", f"Archiving failed:\n{error}", parent=notify)
+            elif moved is None:
+                messagebox.showinfo("Archive", "Another terminal is archiving right now; try again later.", parent=notify)
+            else:
+                messagebox.showinfo("Archive", f"Archived {moved} old orders.", parent=notify)
+
+        self.archive_thread = self._run_background(compact_orders, done, interval=500)
+
+    # -------------------------
+    # UPI statement reconciliation (admin)
+    # -------------------------
+    def open_reconciliation(self, parent):
+        path = filedialog.askopenfilename(parent=parent, title="Select bank / UPI statement",
+                                          filetypes=[("CSV files", "*.csv"), ("All files", "*.*")])
+        if not path:
+            return
+        try:
+            txns = read_statement_csv(path)
+        except Exception as e:
+            messagebox.showerror("Statement", f"Could not read statement:\n{e}", parent=parent)
+            return
+        times = [t["time"] for t in txns if t["time"]]
+        if not times:
+            messagebox.showinfo("Statement", "No dated credit transactions found.", parent=parent)
+            return
+        if not MYSQL_AVAILABLE:
+            messagebox.showerror("DB Error", "MySQL connector not available. Reconciliation disabled.", parent=parent)
+            return
+        try:
+            # one day either side: payments posting after midnight, statements starting
+            # the day after an order; the reference / time-window joins prevent false matches
+            orders = fetch_online_orders(min(times).date() - timedelta(days=1),
+                                         max(times).date() + timedelta(days=1))
+        except Exception as e:
+            messagebox.showerror("DB Error", f"Could not fetch orders:\n{e}", parent=parent)
+            return
+
+        result = reconcile_transactions(txns, orders)
+
+        win = Toplevel(parent)
+        win.title("UPI Reconciliation")
+        win.geometry("760x480+320+160")
+        win.transient(parent)
+        tk.Label(win, text=f"Matched: {len(result['matched'])} | Unmatched payments: {len(result['unmatched_txns'])} | "
+                           f"Unpaid online orders: {len(result['unmatched_orders'])}",
+                 font=("Arial", 12, "bold"), bg="#0984e3", fg="white").pack(fill="x")
+
+        tree = ttk.Treeview(win, columns=("kind", "when", "amount", "ref", "detail"), show="headings")
+        for c, h, wdt in (("kind", "Type", 140), ("when", "Time", 140), ("amount", "Amount ₹", 80),
+                          ("ref", "Reference", 160), ("detail", "Detail", 220)):
+            tree.heading(c, text=h)
+            tree.column(c, width=wdt)
+        tree.pack(fill="both", expand=True, padx=8, pady=8)
+        for t in result["unmatched_txns"]:
+            tree.insert("", "end", values=("Unmatched payment", t["time"] or "—", rupees(t["amount"]),
+                                           t["ref"] or "—", f"line {t['line']}: {t['remarks']}"))
+        for o in result["unmatched_orders"]:
+            tree.insert("", "end", values=("Unpaid order", o.get("created_at") or "—", rupees(o["price_paise"]),
+                                           o.get("order_ref") or "—", f"order #{o['id']} ({o['student_id']})"))
+
+        def export_report():
+            out = filedialog.asksaveasfilename(parent=win, defaultextension=".csv", filetypes=[("CSV files", "*.csv")])
+            if not out:
+                return
+            with open(out, "w", newline="", encoding="utf-8") as fh:
+                wr = csv.writer(fh)
+                wr.writerow(["status", "match", "order_id", "order_ref", "amount", "txn_time", "txn_line", "remarks"])
+                for t, o, how in result["matched"]:
+                    wr.writerow(["matched", how, o["id"], o.get("order_ref"), rupees(t["amount"]), t["time"], t["line"], t["remarks"]])
+                for t in result["unmatched_txns"]:
+                    wr.writerow(["unmatched_payment", "", "", t["ref"], rupees(t["amount"]), t["time"], t["line"], t["remarks"]])
+                for o in result["unmatched_orders"]:
+                    wr.writerow(["unpaid_order", "", o["id"], o.get("order_ref"), rupees(o["price_paise"]), o.get("created_at"), "", ""])
+            messagebox.showinfo("Saved", f"Report saved to {out}", parent=win)
+
+        tk.Button(win, text="Export Report", bg="#00b894", fg="white", command=export_report).pack(side="left", padx=8, pady=6)
+        tk.Button(win, text="Close", bg="#6c757d", fg="white", command=win.destroy).pack(side="right", padx=8, pady=6)
+
     # -------------------------
     # Dark / Light Mode
     # -------------------------
@@ -821,9 +2307,16 @@ class CanteenApp:
     # Run
     # -------------------------
 def main():
-    root = tk.Tk()
+    if "--migrate-money" in sys.argv:
+        print("Migrated:", ", ".join(migrate_money_schema()) or "nothing to do")
+        return
+    PROFILER.record("module import", _STARTUP_T0, _MODULE_LOADED)
+    with PROFILER.phase("tk init"):
+        root = tk.Tk()
     app = CanteenApp(root)
     root.mainloop()
 
+_MODULE_LOADED = time.perf_counter()
+
 if __name__ == "__main__":
     main()